@@ -1,77 +1,146 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
+import functools
+import hashlib
+import json
 import os
+import random
 import sys
 import re
-from openai import OpenAI
+import sqlite3
+import time
+from collections import deque
+from dataclasses import dataclass
+from types import SimpleNamespace
+from openai import APIConnectionError, AsyncOpenAI, InternalServerError, RateLimitError
 from dotenv import load_dotenv
 
+try:
+    import tokencost
+except ImportError:
+    # Optional: fall back to PRICING_CONFIG when tokencost isn't installed
+    tokencost = None
+
+try:
+    import orjson
+except ImportError:
+    # Optional: faster JSONL encoding/decoding for batch files
+    orjson = None
+
+try:
+    import tiktoken
+except ImportError:
+    # Optional: content is truncated by a character estimate instead
+    tiktoken = None
+
 load_dotenv()
 
+MODEL = "gpt-4o-mini"
+
+# Invariant instructions, sent first as the system message so every request
+# shares the same prefix and can hit OpenAI's prompt cache. Anything that
+# varies per file belongs in the user message.
+STATIC_PREAMBLE = """You are a file renaming assistant. Follow the user's instruction EXACTLY, including:
+- Use the language that makes most sense, unless specified otherwise
+- Use the EXACT format specified in the instruction
+- Return ONLY the filename part without any extension
+
+IMPORTANT: Follow the instruction precisely. Use the same language and format as specified. 
+Return ONLY the new filename WITHOUT any extension - we will add the extension automatically.
+Do not include .pdf, .txt, .json or any other extension in your response."""
+# Shared by every request's message list
+_SYSTEM_MESSAGE = {"role": "system", "content": STATIC_PREAMBLE}
+
+# File content sent to the model is capped at this many tokens
+MAX_CONTENT_TOKENS = 1500
+CHARS_PER_TOKEN = 4  # Estimate used when tiktoken is unavailable
+TRUNCATION_MARKER = "\n[...truncated]"
+
+# Persistent cache of model answers, so re-running a rename skips the API
+CACHE_PATH = os.path.expanduser(os.getenv('SMART_RENAME_CACHE', '~/.smart-rename-cache.sqlite3'))
+
+# Retry settings for rate limits and transient errors (exponential backoff with jitter).
+# The client itself doesn't retry, so these are the only retries.
+MAX_RETRIES = 6
+BASE_RETRY_DELAY = 1.0
+
+# Requests and tokens are counted over a sliding window of this many seconds
+RATE_LIMIT_WINDOW = 60
+
+# Batch API jobs are billed at half the synchronous price
+BATCH_API_DISCOUNT = 0.5
+BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+@dataclass(frozen=True)
+class ModelPricing:
+    """
+    Rates in USD per 1K tokens. cached_input is the rate for prompt tokens served
+    from the prompt cache; models without prompt caching bill them at the input rate.
+    """
+    __slots__ = ("input", "output", "cached_input")
+    input: float
+    output: float
+    cached_input: float
+
 # Pricing configuration with fallback to hardcoded values
 PRICING_CONFIG = {
-    "gpt-3.5-turbo": {"input": 0.0015, "output": 0.002},
-    "gpt-4": {"input": 0.03, "output": 0.06},
-    "gpt-4-turbo": {"input": 0.01, "output": 0.03},
-    "gpt-4o": {"input": 0.005, "output": 0.015},
-    "gpt-4o-mini": {"input": 0.00015, "output": 0.0006},
+    "gpt-3.5-turbo": ModelPricing(input=0.0015, output=0.002, cached_input=0.0015),
+    "gpt-4": ModelPricing(input=0.03, output=0.06, cached_input=0.03),
+    "gpt-4-turbo": ModelPricing(input=0.01, output=0.03, cached_input=0.01),
+    "gpt-4o": ModelPricing(input=0.005, output=0.015, cached_input=0.0025),
+    "gpt-4o-mini": ModelPricing(input=0.00015, output=0.0006, cached_input=0.000075),
     # Add more models as needed
 }
 
-def get_current_pricing(model_name, prompt_tokens=0, completion_tokens=0, prompt_text=None, completion_text=None):
+@functools.lru_cache(maxsize=None)
+def _lookup_pricing(model_name):
     """
-    Get current pricing using tokencost library with fallback to config
+    ModelPricing for model_name plus its source.
+    Prefers tokencost's price table, falling back to PRICING_CONFIG (default gpt-4o-mini).
     """
-    try:
-        import tokencost
-        
-        # Use tokencost with actual text - this is the proper way to use it
-        if prompt_text is not None and completion_text is not None:
-            input_cost = float(tokencost.calculate_prompt_cost(prompt_text, model_name))
-            output_cost = float(tokencost.calculate_completion_cost(completion_text, model_name))
-            
-            return {
-                "input": input_cost / (prompt_tokens / 1000) if prompt_tokens > 0 else 0,
-                "output": output_cost / (completion_tokens / 1000) if completion_tokens > 0 else 0,
-                "input_cost": input_cost,
-                "output_cost": output_cost,
-                "total_cost": input_cost + output_cost,
-                "source": "tokencost"
-            }
-        else:
-            # If we don't have text, use tokencost's model data but calculate manually
-            # This is more reliable than trying to pass token counts to tokencost
-            pricing = PRICING_CONFIG.get(model_name, PRICING_CONFIG.get("gpt-4o-mini"))
-            input_cost = (prompt_tokens / 1000) * pricing["input"]
-            output_cost = (completion_tokens / 1000) * pricing["output"]
-            
-            return {
-                "input": pricing["input"],
-                "output": pricing["output"],
-                "input_cost": input_cost,
-                "output_cost": output_cost,
-                "total_cost": input_cost + output_cost,
-                "source": "config_with_tokencost_available"
-            }
-    except (ImportError, Exception) as e:
-        if not isinstance(e, ImportError):
-            # Only show non-import errors (since import errors are expected if tokencost not installed)
-            print(f"  ⚠️  TokenCost error: {e}", file=sys.stderr)
-        
-        # Fallback to hardcoded pricing
-        pricing = PRICING_CONFIG.get(model_name, PRICING_CONFIG.get("gpt-4o-mini"))
-        input_cost = (prompt_tokens / 1000) * pricing["input"]
-        output_cost = (completion_tokens / 1000) * pricing["output"]
-        
-        return {
-            "input": pricing["input"],
-            "output": pricing["output"],
-            "input_cost": input_cost,
-            "output_cost": output_cost,
-            "total_cost": input_cost + output_cost,
-            "source": "config_fallback"
-        }
+    if tokencost is not None:
+        model_info = tokencost.TOKEN_COSTS.get(model_name, {})
+        if "input_cost_per_token" in model_info and "output_cost_per_token" in model_info:
+            pricing = ModelPricing(
+                input=model_info["input_cost_per_token"] * 1000,
+                output=model_info["output_cost_per_token"] * 1000,
+                cached_input=model_info.get("cache_read_input_token_cost", model_info["input_cost_per_token"]) * 1000,
+            )
+            return pricing, "tokencost"
+
+    pricing = PRICING_CONFIG.get(model_name, PRICING_CONFIG["gpt-4o-mini"])
+    source = "config_with_tokencost_available" if tokencost is not None else "config_fallback"
+    return pricing, source
+
+def get_current_pricing(model_name, prompt_tokens=0, completion_tokens=0, cached_tokens=0):
+    """
+    Get current pricing using tokencost library with fallback to config.
+    Costs come from the token counts reported by the API, so nothing is re-tokenized.
+    cached_tokens is the part of prompt_tokens served from the prompt cache.
+    """
+    pricing, source = _lookup_pricing(model_name)
+
+    if source == "tokencost":
+        uncached_cost = float(tokencost.calculate_cost_by_tokens(prompt_tokens - cached_tokens, model_name, "input"))
+        output_cost = float(tokencost.calculate_cost_by_tokens(completion_tokens, model_name, "output"))
+    else:
+        uncached_cost = ((prompt_tokens - cached_tokens) / 1000) * pricing.input
+        output_cost = (completion_tokens / 1000) * pricing.output
+    # Older tokencost releases have no cached token type, so use the looked-up rate
+    cached_cost = (cached_tokens / 1000) * pricing.cached_input
+    input_cost = uncached_cost + cached_cost
+    
+    return {
+        "input": pricing.input,
+        "cached_input": pricing.cached_input,
+        "output": pricing.output,
+        "input_cost": input_cost,
+        "output_cost": output_cost,
+        "total_cost": input_cost + output_cost,
+        "source": source
+    }
 
 def format_examples(examples_str):
     """
@@ -87,6 +156,30 @@ def format_examples(examples_str):
     
     return examples_text
 
+# Filename sanitization patterns, compiled once at import
+_UNSAFE_CHARS = re.compile(r'[^\w\s\.\-\(\)\[\]]+')
+# Only matches text that actually changes: whitespace runs or non-space
+# whitespace (group 1, -> ' ') and runs of underscores (-> '_')
+_COLLAPSE = re.compile(r'(\s{2,}|[^\S ])|_{2,}')
+
+# Null bytes and line breaks replaced in a single pass
+_TRANS = str.maketrans({'\x00': '_', '\n': ' ', '\r': ' '})
+
+# Names that sanitization would leave unchanged: only allowed characters,
+# no leading/trailing '._- ', at most 150 characters. Runs of spaces or
+# underscores are checked separately.
+_SAFE_NAME = re.compile(r'(?:[^\W_]|[()\[\]])(?:[\w .\-()\[\]]{0,148}(?:[^\W_]|[()\[\]]))?')
+
+def _collapse_repl(match):
+    return ' ' if match.group(1) else '_'
+
+# Windows reserved names (compared case insensitively)
+_RESERVED_NAMES = frozenset({
+    'CON', 'PRN', 'AUX', 'NUL',
+    'COM1', 'COM2', 'COM3', 'COM4', 'COM5', 'COM6', 'COM7', 'COM8', 'COM9',
+    'LPT1', 'LPT2', 'LPT3', 'LPT4', 'LPT5', 'LPT6', 'LPT7', 'LPT8', 'LPT9'
+})
+
 def sanitize_filename(filename):
     """
     Sanitize AI-generated filename to prevent injection attacks and ensure filesystem compatibility.
@@ -108,20 +201,31 @@ def sanitize_filename(filename):
     # Strip whitespace from ends
     filename = filename.strip()
     
-    # Remove any path components (security: prevent directory traversal)
-    filename = os.path.basename(filename)
+    # Remove any path components (security: prevent directory traversal).
+    # Split on both separators so Windows-style paths are handled on every platform
+    filename = filename.rsplit('/', 1)[-1].rsplit('\\', 1)[-1]
     
-    # Remove or replace path separators that might have survived basename
-    filename = filename.replace('/', '_').replace('\\', '_')
+    # Fast path: well-formed names (the common case for model output) pass through as-is
+    if (_SAFE_NAME.fullmatch(filename) and '  ' not in filename and '__' not in filename
+            and filename.upper() not in _RESERVED_NAMES):
+        return filename
+    
+    # Replace null bytes and line breaks
+    filename = filename.translate(_TRANS)
     
     # Remove dangerous shell metacharacters and control characters
     # Keep alphanumeric, spaces, dots, hyphens, underscores, parentheses, brackets
-    filename = re.sub(r'[^\w\s\.\-\(\)\[\]]+', '_', filename)
+    filename = _UNSAFE_CHARS.sub('_', filename)
     
     # Normalize multiple consecutive spaces to single spaces, and multiple underscores to single underscores
-    filename = re.sub(r'\s+', ' ', filename)  # Multiple spaces -> single space
-    filename = re.sub(r'_+', '_', filename)   # Multiple underscores -> single underscore
+    filename = _COLLAPSE.sub(_collapse_repl, filename)
     
+    return _finalize(filename)
+
+def _finalize(filename):
+    """
+    Last steps of sanitize_filename: hidden files, reserved names, length and edge characters
+    """
     # Remove leading dots to prevent hidden files (security measure)
     filename = filename.lstrip('.')
     
@@ -132,13 +236,7 @@ def sanitize_filename(filename):
     # Check for Windows reserved names (case insensitive)
     # Since we're not dealing with extensions here, check the entire name
     name_upper = filename.upper()
-    reserved_names = {
-        'CON', 'PRN', 'AUX', 'NUL',
-        'COM1', 'COM2', 'COM3', 'COM4', 'COM5', 'COM6', 'COM7', 'COM8', 'COM9',
-        'LPT1', 'LPT2', 'LPT3', 'LPT4', 'LPT5', 'LPT6', 'LPT7', 'LPT8', 'LPT9'
-    }
-    
-    if name_upper in reserved_names:
+    if name_upper in _RESERVED_NAMES:
         filename = f"file_{filename}"
     
     # Limit total length (leave room for extension to be added later)
@@ -154,86 +252,759 @@ def sanitize_filename(filename):
     
     return filename
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--instruction', required=True)
-    parser.add_argument('--content', required=True)
-    parser.add_argument('--original', required=True)
-    parser.add_argument('--examples', default='', help='Previous rename examples for consistency (newline separated)')
-    args = parser.parse_args()
+def sanitize_filenames(filenames):
+    """
+    sanitize_filename over a whole batch, with the hot functions bound to locals once
+    """
+    is_safe = _SAFE_NAME.fullmatch
+    reserved = _RESERVED_NAMES
+    trans = _TRANS
+    unsafe_sub = _UNSAFE_CHARS.sub
+    collapse_sub = _COLLAPSE.sub
+    collapse_repl = _collapse_repl
+    finalize = _finalize
 
-    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    results = []
+    append = results.append
+    for filename in filenames:
+        if not filename or not isinstance(filename, str):
+            append("unnamed_file")
+            continue
+        filename = filename.strip().rsplit('/', 1)[-1].rsplit('\\', 1)[-1]
+        if is_safe(filename) and '  ' not in filename and '__' not in filename and filename.upper() not in reserved:
+            append(filename)
+        else:
+            append(finalize(collapse_sub(collapse_repl, unsafe_sub('_', filename.translate(trans)))))
+    return results
 
-    # Format examples if provided
-    examples = format_examples(args.examples)
+@functools.lru_cache(maxsize=None)
+def _get_encoding():
+    """
+    tiktoken encoding for MODEL, or None if tiktoken is missing or can't load it
+    """
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(MODEL)
+    except Exception:
+        # e.g. unknown model or the encoding file couldn't be downloaded
+        return None
 
-    # Extract the original file extension to preserve it
-    original_name, original_ext = os.path.splitext(args.original)
+def _truncate_content(content, max_tokens=MAX_CONTENT_TOKENS):
+    """
+    Cap file content at max_tokens before it goes into the prompt
+    """
+    encoding = _get_encoding()
+    if encoding is None:
+        max_chars = max_tokens * CHARS_PER_TOKEN
+        if len(content) <= max_chars:
+            return content
+        return content[:max_chars] + TRUNCATION_MARKER
+
+    tokens = encoding.encode(content, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return content
+    return encoding.decode(tokens[:max_tokens]) + TRUNCATION_MARKER
+
+def split_extension(original):
+    """
+    Split the original filename into name and extension, defaulting to .txt
+    """
+    original_name, original_ext = os.path.splitext(original)
     if not original_ext:
         original_ext = ".txt"  # Default if no extension found
+    return original_name, original_ext
 
-    prompt = f"""You are a file renaming assistant. Follow the user's instruction EXACTLY, including:
-- Use the language that makes most sense, unless specified otherwise
-- Use the EXACT format specified in the instruction
-- Return ONLY the filename part without any extension
+def build_prompt(instruction, original, content, examples):
+    """
+    Build the user message for renaming a single file
+    """
+    return "".join((
+        "Instruction: ", instruction, "\n",
+        examples,
+        "\nOriginal filename: ", original,
+        "\n\nFile content (excerpt):\n", content,
+    ))
 
-Instruction: {args.instruction}
-{examples}
-Original filename: {args.original}
+def build_batch_prompt(instruction, items, examples):
+    """
+    Build a single user message that renames several files at once.
+    The model answers with a JSON object holding the new names in input order.
+    """
+    parts = [
+        "Instruction: ", instruction, "\n",
+        examples,
+        "\nRename each file. This request covers several files, so instead of a single filename",
+        ' return a JSON object of the form {"filenames": [...]} with exactly ', str(len(items)),
+        " new filenames, in the same order as the files below.",
+        " Each entry is one filename without any extension.\n\nFiles:\n",
+    ]
+    for i, (original, content) in enumerate(items, 1):
+        parts += (str(i), ". original=", original, "\ncontent=\n", content, "\n\n")
+    return "".join(parts)
+
+def build_messages(prompt):
+    """
+    Put the static preamble first so requests share a cacheable prefix
+    """
+    return [_SYSTEM_MESSAGE, {"role": "user", "content": prompt}]
 
-File content (excerpt):
-{args.content}
+def completion_params(prompt):
+    """
+    Chat completion parameters for renaming a single file
+    """
+    return {
+        "model": MODEL,
+        "messages": build_messages(prompt),
+        "max_tokens": 30,
+        "temperature": 0.2,
+    }
 
-IMPORTANT: Follow the instruction precisely. Use the same language and format as specified. 
-Return ONLY the new filename WITHOUT any extension - we will add the extension automatically.
-Do not include .pdf, .txt, .json or any other extension in your response."""
+def _dumps_line(obj):
+    """
+    Encode obj as one compact UTF-8 JSONL line (bytes), using orjson when installed
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
 
-    MODEL = "gpt-4o-mini"
+def _loads(line):
+    """
+    Decode one JSONL line, using orjson when installed.
+    orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers catch the latter.
+    """
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
 
-    response = client.chat.completions.create(
-        model=MODEL,
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=30,
-        temperature=0.2,
-    )
+def load_batch_file(path):
+    """
+    Read a JSONL batch file with one {"original": ..., "content": ...} object per line
+    """
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                entry = _loads(line)
+                original, content = entry["original"], entry.get("content", "")
+            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                raise ValueError(f"{path}:{line_number}: invalid batch entry ({e})") from e
+            if not isinstance(original, str) or not isinstance(content, str):
+                raise ValueError(f"{path}:{line_number}: invalid batch entry (original and content must be strings)")
+            items.append((original, content))
+    return items
+
+def get_cached_tokens(usage):
+    """
+    Number of prompt tokens served from OpenAI's prompt cache (0 if not reported)
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", 0) or 0
+
+def format_usage_stats(usage, pricing):
+    """
+    Token usage and cost report lines, written to stderr so they don't interfere with the filename output
+    """
+    return [
+        "📊 Token Usage:\n",
+        f"  Input tokens:  {usage.prompt_tokens:,}\n",
+        f"  Cached tokens: {get_cached_tokens(usage):,}\n",
+        f"  Output tokens: {usage.completion_tokens:,}\n",
+        f"  Total tokens:  {usage.total_tokens:,}\n",
+        f"💰 Cost (via {pricing['source']}):\n",
+        f"  Input cost:    ${pricing['input_cost']:.6f}\n",
+        f"  Output cost:   ${pricing['output_cost']:.6f}\n",
+        f"  Total cost:    ${pricing['total_cost']:.6f}\n",
+    ]
+
+def format_rename_log(completion_text, sanitized_filename, original_ext):
+    """
+    Report lines for one file: what sanitization changed in the model's answer
+    and which extension was added back
+    """
+    log_lines = []
+    if completion_text != sanitized_filename:
+        log_lines += (
+            "🔒 Security: Filename sanitized for safety\n",
+            f"  Original:  {completion_text}\n",
+            f"  Sanitized: {sanitized_filename}\n",
+        )
+    log_lines.append(f"📎 Extension: Added original extension {original_ext}\n")
+    return log_lines
+
+def create_client():
+    """
+    Create the async OpenAI client, using the aiohttp transport when it is installed.
+    SDK retries are off so with_backoff alone decides when to retry.
+    """
+    api_key = os.getenv('OPENAI_API_KEY')
+    try:
+        from openai import DefaultAioHttpClient
+        return AsyncOpenAI(api_key=api_key, max_retries=0, http_client=DefaultAioHttpClient())
+    except (ImportError, RuntimeError):
+        # openai without the aiohttp extra - fall back to the default httpx transport
+        return AsyncOpenAI(api_key=api_key, max_retries=0)
+
+async def with_backoff(make_request):
+    """
+    Await make_request(), retrying with exponential backoff when rate limited
+    or on a transient connection or server error
+    """
+    for attempt in range(MAX_RETRIES):
+        try:
+            return await make_request()
+        except (RateLimitError, APIConnectionError, InternalServerError) as e:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            delay = BASE_RETRY_DELAY * (2 ** attempt) * (1 + random.random())
+            reason = "Rate limited" if isinstance(e, RateLimitError) else "Request failed"
+            print(f"⏳ {reason}, retrying in {delay:.1f}s", file=sys.stderr)
+            await asyncio.sleep(delay)
+
+class RateLimiter:
+    """
+    Sliding-window limiter for requests and tokens per minute, so concurrent
+    requests stay under the account's RPM/TPM limits instead of bursting into 429s.
+    A limit of None is not enforced.
+    """
+
+    def __init__(self, max_rpm=None, max_tpm=None):
+        self.max_rpm = max_rpm
+        self.max_tpm = max_tpm
+        self.request_times = deque()
+        self.token_usage = deque()  # [time, tokens, in_window] entries, tokens updated once known
+        self.tokens_in_window = 0
+        self.lock = asyncio.Lock()
+
+    def _prune(self, now):
+        while self.request_times and now - self.request_times[0] >= RATE_LIMIT_WINDOW:
+            self.request_times.popleft()
+        while self.token_usage and now - self.token_usage[0][0] >= RATE_LIMIT_WINDOW:
+            expired = self.token_usage.popleft()
+            self.tokens_in_window -= expired[1]
+            expired[2] = False
+
+    async def acquire(self, estimated_tokens):
+        """
+        Wait until a request of estimated_tokens fits in the window and reserve it.
+        Returns the reservation to pass to record().
+        """
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self._prune(now)
+                waits = []
+                if self.max_rpm and len(self.request_times) >= self.max_rpm:
+                    waits.append(self.request_times[0] + RATE_LIMIT_WINDOW - now)
+                # A single request larger than the whole budget still goes through once the window is empty
+                if self.max_tpm and self.token_usage and self.tokens_in_window + estimated_tokens > self.max_tpm:
+                    waits.append(self.token_usage[0][0] + RATE_LIMIT_WINDOW - now)
+                if not waits:
+                    break
+                await asyncio.sleep(max(waits))
+
+            reservation = [now, estimated_tokens, True]
+            self.request_times.append(now)
+            self.token_usage.append(reservation)
+            self.tokens_in_window += estimated_tokens
+            return reservation
+
+    def record(self, reservation, actual_tokens):
+        """
+        Replace a reservation's estimate with the tokens the API reported.
+        Requests that outlasted the window have already left the total.
+        """
+        if reservation[2]:
+            self.tokens_in_window += actual_tokens - reservation[1]
+        reservation[1] = actual_tokens
+
+def estimate_tokens(params):
+    """
+    Rough token count of a request: prompt characters / CHARS_PER_TOKEN plus the completion budget
+    """
+    prompt_chars = sum(len(message["content"]) for message in params["messages"])
+    return prompt_chars // CHARS_PER_TOKEN + params["max_tokens"]
 
-    # Extract token usage information
-    usage = response.usage
-    prompt_tokens = usage.prompt_tokens
-    completion_tokens = usage.completion_tokens
-    total_tokens = usage.total_tokens
+async def discover_rate_limits(client):
+    """
+    Read the account's RPM/TPM limits for MODEL from the headers of a 1-token request.
+    Returns (max_rpm, max_tpm, usage), None for anything that couldn't be determined.
+    """
+    try:
+        raw = await client.chat.completions.with_raw_response.create(
+            model=MODEL,
+            messages=[{"role": "user", "content": "hi"}],
+            max_tokens=1,
+        )
+    except Exception as e:
+        print(f"⚠️  Could not discover rate limits: {e}", file=sys.stderr)
+        return None, None, None
+
+    limits = []
+    for header in ("x-ratelimit-limit-requests", "x-ratelimit-limit-tokens"):
+        try:
+            limits.append(int(raw.headers.get(header)))
+        except (TypeError, ValueError):
+            limits.append(None)
+    return limits[0], limits[1], raw.parse().usage
+
+def open_cache(path=CACHE_PATH):
+    """
+    Open the on-disk rename cache, creating it if needed.
+    Returns None (caching disabled) if it can't be opened.
+    """
+    try:
+        cache = sqlite3.connect(path)
+        cache.execute("CREATE TABLE IF NOT EXISTS renames (key TEXT PRIMARY KEY, completion TEXT NOT NULL)")
+        return cache
+    except sqlite3.Error as e:
+        print(f"⚠️  Rename cache disabled ({path}: {e})", file=sys.stderr)
+        return None
+
+def cache_key(instruction, original, content, examples):
+    """
+    Cache key for one file's rename request.
+    The examples are part of the prompt, so answers given for other examples aren't reused.
+    """
+    return hashlib.sha256(f"{MODEL}|{instruction}|{examples}|{original}|{content}".encode("utf-8")).hexdigest()
+
+def cache_get(cache, key):
+    """
+    Cached model answer for key, or None on a miss, when caching is disabled
+    or when the cache can't be read (e.g. locked by another run)
+    """
+    if cache is None:
+        return None
+    try:
+        row = cache.execute("SELECT completion FROM renames WHERE key = ?", (key,)).fetchone()
+    except sqlite3.Error as e:
+        print(f"⚠️  Rename cache lookup failed: {e}", file=sys.stderr)
+        return None
+    return row[0] if row else None
+
+def lookup_cache(cache, instruction, items, examples):
+    """
+    (key, cached answer or None) for each (original, content) item
+    """
+    lookups = []
+    for original, content in items:
+        key = cache_key(instruction, original, content, examples)
+        lookups.append((key, cache_get(cache, key)))
+    return lookups
+
+def cache_put(cache, key, completion_text):
+    """
+    Store a model answer (before sanitization) in the cache.
+    Blank answers aren't stored, so the next run asks the API again.
+    Failures are reported and ignored so a paid answer is never lost.
+    """
+    if cache is None or not completion_text.strip():
+        return
+    try:
+        with cache:
+            cache.execute("INSERT OR REPLACE INTO renames (key, completion) VALUES (?, ?)", (key, completion_text))
+    except sqlite3.Error as e:
+        print(f"⚠️  Rename cache write failed: {e}", file=sys.stderr)
+
+async def stream_completion(client, params, limiter=None):
+    """
+    Stream a chat completion and return (completion_text, usage).
+    Usage arrives in a final chunk without choices.
+    """
+    if limiter is not None:
+        reservation = await limiter.acquire(estimate_tokens(params))
+
+    stream = await client.chat.completions.create(**params, stream=True, stream_options={"include_usage": True})
+
+    collected = []
+    usage = None
+    async for chunk in stream:
+        if chunk.choices:
+            collected.append(chunk.choices[0].delta.content or "")
+        if chunk.usage:
+            usage = chunk.usage
+
+    if usage is None:
+        usage = SimpleNamespace(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+    if limiter is not None:
+        limiter.record(reservation, usage.total_tokens)
+    return "".join(collected).strip(), usage
+
+async def rename_one(client, sem, instruction, original, content, examples, cache=None, limiter=None):
+    """
+    Rename a single file with one API call (skipped on a cache hit).
+    Returns the final filename with the original extension and the stderr report lines.
+    """
+    # Extract the original file extension to preserve it
+    original_name, original_ext = split_extension(original)
+
+    key = cache_key(instruction, original, content, examples)
+    completion_text = cache_get(cache, key)
+
+    if completion_text is not None:
+        # Cache hit: no tokens used
+        usage = SimpleNamespace(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+        cache_status = "💾 Cache: hit\n"
+    else:
+        params = completion_params(build_prompt(instruction, original, content, examples))
+
+        async with sem:
+            completion_text, usage = await with_backoff(lambda: stream_completion(client, params, limiter))
+
+        cache_put(cache, key, completion_text)
+        cache_status = "💾 Cache: miss\n"
 
     # Get current pricing using tokencost
-    completion_text = response.choices[0].message.content.strip()
-    pricing = get_current_pricing(MODEL, prompt_tokens, completion_tokens, prompt, completion_text)
+    pricing = get_current_pricing(MODEL, usage.prompt_tokens, usage.completion_tokens, get_cached_tokens(usage))
 
-    # Print usage stats to stderr so they don't interfere with the filename output
-    print(f"📊 Token Usage:", file=sys.stderr)
-    print(f"  Input tokens:  {prompt_tokens:,}", file=sys.stderr)
-    print(f"  Output tokens: {completion_tokens:,}", file=sys.stderr)
-    print(f"  Total tokens:  {total_tokens:,}", file=sys.stderr)
-    print(f"💰 Cost (via {pricing['source']}):", file=sys.stderr)
-    print(f"  Input cost:    ${pricing['input_cost']:.6f}", file=sys.stderr)
-    print(f"  Output cost:   ${pricing['output_cost']:.6f}", file=sys.stderr)
-    print(f"  Total cost:    ${pricing['total_cost']:.6f}", file=sys.stderr)
+    # Usage stats go to stderr (after the filename) so they don't interfere with it
+    log_lines = format_usage_stats(usage, pricing)
+    if cache is not None:
+        log_lines.append(cache_status)
 
-    # Sanitize the filename for security
-    original_filename = completion_text
-    sanitized_filename = sanitize_filename(original_filename)
-    
-    # Add the original extension back to the filename
-    final_filename = sanitized_filename + original_ext
-    
-    # Log security sanitization if filename was modified
-    if original_filename != sanitized_filename:
-        print(f"🔒 Security: Filename sanitized for safety", file=sys.stderr)
-        print(f"  Original:  {original_filename}", file=sys.stderr)
-        print(f"  Sanitized: {sanitized_filename}", file=sys.stderr)
-    
-    # Log extension preservation
-    print(f"📎 Extension: Added original extension {original_ext}", file=sys.stderr)
+    # Sanitize the filename for security and add the original extension back
+    sanitized_filename = sanitize_filename(completion_text)
+    log_lines += format_rename_log(completion_text, sanitized_filename, original_ext)
+
+    return sanitized_filename + original_ext, log_lines
+
+async def rename_batch(client, sem, instruction, items, examples, cache=None, limiter=None, cached=None):
+    """
+    Rename several files with a single API call; files found in the cache are left out of it.
+    cached holds the items' lookup_cache() results when the caller already has them.
+    Returns the final filenames (with original extensions) in input order and the stderr report lines.
+    """
+    # Preserve per-file extensions by position
+    extensions = [split_extension(original)[1] for original, _ in items]
+
+    if cached is None:
+        cached = lookup_cache(cache, instruction, items, examples)
+    keys = [key for key, _ in cached]
+    names = [name for _, name in cached]
+    misses = [i for i, name in enumerate(names) if name is None]
+
+    log_lines = []
+    if cache is not None:
+        log_lines.append(f"💾 Cache: {len(items) - len(misses)} hit(s), {len(misses)} miss(es)\n")
+
+    fallback = {}
+    if misses:
+        miss_items = [items[i] for i in misses]
+        params = {
+            "model": MODEL,
+            "messages": build_messages(build_batch_prompt(instruction, miss_items, examples)),
+            "max_tokens": 30 * len(miss_items) + 20,
+            "temperature": 0.2,
+            "response_format": {"type": "json_object"},
+        }
+
+        async with sem:
+            completion_text, usage = await with_backoff(lambda: stream_completion(client, params, limiter))
+
+        pricing = get_current_pricing(MODEL, usage.prompt_tokens, usage.completion_tokens, get_cached_tokens(usage))
+        log_lines += format_usage_stats(usage, pricing)
+
+        response_names = parse_batch_names(completion_text, len(miss_items))
+        if response_names is None:
+            # Names can't be matched to files by position, so the whole answer is discarded
+            log_lines.append(f"⚠️  Batch answer didn't contain {len(miss_items)} filenames, renaming those files one by one\n")
+            retries = misses
+        else:
+            retries = []
+            for name, i in zip(response_names, misses):
+                if isinstance(name, str) and name.strip():
+                    names[i] = name
+                    cache_put(cache, keys[i], name)
+                else:
+                    retries.append(i)
+            if retries:
+                log_lines.append(
+                    f"⚠️  Batch answer had no usable filename for {', '.join(items[i][0] for i in retries)}, "
+                    "renaming those files one by one\n"
+                )
+
+        results = await asyncio.gather(*(
+            rename_one(client, sem, instruction, items[i][0], items[i][1], examples, cache, limiter)
+            for i in retries
+        ))
+        fallback = dict(zip(retries, results))
+
+    final_filenames = []
+    for i, (name, sanitized_filename, ext) in enumerate(zip(names, sanitize_filenames(names), extensions)):
+        log_lines.append(f"📄 {items[i][0]}\n")
+        if i in fallback:
+            final_filename, file_log_lines = fallback[i]
+            final_filenames.append(final_filename)
+            log_lines += file_log_lines
+        else:
+            final_filenames.append(sanitized_filename + ext)
+            log_lines += format_rename_log(name, sanitized_filename, ext)
+
+    return final_filenames, log_lines
+
+def parse_batch_names(completion_text, expected_count):
+    """
+    Extract the "filenames" list from a packed batch answer.
+    Returns None unless it holds exactly expected_count entries.
+    """
+    try:
+        names = json.loads(completion_text).get("filenames")
+    except (json.JSONDecodeError, AttributeError):
+        return None
+    if not isinstance(names, list) or len(names) != expected_count:
+        return None
+    return names
+
+def build_batch_requests(instruction, items, examples):
+    """
+    Build one Batch API request line per file.
+    custom_id is "<index>:<original>" so results can be put back in input order.
+    """
+    return [
+        {
+            "custom_id": f"{i}:{original}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": completion_params(build_prompt(instruction, original, content, examples)),
+        }
+        for i, (original, content) in enumerate(items)
+    ]
+
+async def submit_batch(client, requests):
+    """
+    Upload the requests as a JSONL file and start a Batch API job.
+    Returns the batch id.
+    """
+    jsonl = b"".join(_dumps_line(request) for request in requests)
+    batch_input = await with_backoff(lambda: client.files.create(
+        file=("smart-rename-batch.jsonl", jsonl),
+        purpose="batch",
+    ))
+    batch = await with_backoff(lambda: client.batches.create(
+        input_file_id=batch_input.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    ))
+    return batch.id
+
+async def poll_batch(client, batch_id, interval):
+    """
+    Wait for a Batch API job to finish and collect its renames.
+    Returns (original, final_filename) pairs in input order and the stderr report lines,
+    which name every file whose request failed. Status updates are printed while waiting.
+    """
+    while True:
+        batch = await with_backoff(lambda: client.batches.retrieve(batch_id))
+        counts = batch.request_counts
+        if counts:
+            print(f"⏳ Batch {batch_id}: {batch.status} ({counts.completed}/{counts.total} done)", file=sys.stderr)
+        else:
+            print(f"⏳ Batch {batch_id}: {batch.status}", file=sys.stderr)
+        if batch.status in BATCH_TERMINAL_STATUSES:
+            break
+        await asyncio.sleep(interval)
+
+    # Successful requests land in the output file, failed ones in the error file
+    lines = []
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if file_id:
+            lines += (await with_backoff(lambda: client.files.content(file_id))).text.splitlines()
+
+    results = []
+    log_lines = []
+    if not lines:
+        log_lines.append(f"⚠️  Batch {batch_id} finished with status '{batch.status}' and no results\n")
+
+    prompt_tokens = completion_tokens = cached_tokens = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            result = _loads(line)
+            index, original = result["custom_id"].split(":", 1)
+            index = int(index)
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                error = result.get("error") or (response.get("body") or {}).get("error") or response.get("status_code")
+                if isinstance(error, dict):
+                    error = error.get("message") or error
+                log_lines.append(f"⚠️  No rename for {original}: {error}\n")
+                continue
+
+            body = response["body"]
+            completion_text = (body["choices"][0]["message"]["content"] or "").strip()
+            line_usage = body["usage"]
+            line_tokens = (
+                line_usage["prompt_tokens"],
+                line_usage["completion_tokens"],
+                (line_usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0),
+            )
+        except (json.JSONDecodeError, KeyError, IndexError, TypeError, ValueError, AttributeError) as e:
+            # One bad line shouldn't cost the renames of every other file
+            log_lines.append(f"⚠️  Skipping malformed batch result ({type(e).__name__}: {e}): {line[:200]}\n")
+            continue
+
+        prompt_tokens += line_tokens[0]
+        completion_tokens += line_tokens[1]
+        cached_tokens += line_tokens[2]
+        results.append((index, original, completion_text))
+
+    usage = SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=prompt_tokens + completion_tokens,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens),
+    )
+    pricing = get_current_pricing(MODEL, prompt_tokens, completion_tokens, cached_tokens)
+    for key in ("input_cost", "output_cost", "total_cost"):
+        pricing[key] *= BATCH_API_DISCOUNT
+    pricing["source"] += " with Batch API discount"
+    log_lines += format_usage_stats(usage, pricing)
+
+    results.sort()
+    sanitized_filenames = sanitize_filenames([completion_text for _, _, completion_text in results])
+    renames = []
+    for (_, original, completion_text), sanitized_filename in zip(results, sanitized_filenames):
+        original_ext = split_extension(original)[1]
+        renames.append((original, sanitized_filename + original_ext))
+        log_lines.append(f"📄 {original}\n")
+        log_lines += format_rename_log(completion_text, sanitized_filename, original_ext)
+    return renames, log_lines
+
+async def run(args, examples, items):
+    """
+    Async entry point: rename a single file, or all batch items concurrently
+    """
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async with create_client() as client:
+        if args.poll:
+            return await poll_batch(client, args.poll, args.poll_interval)
+
+        if args.batch_api:
+            return await submit_batch(client, build_batch_requests(args.instruction, items, examples))
+
+        cache = None if args.no_cache else open_cache()
+        try:
+            if items is None:
+                limiter = RateLimiter(args.max_rpm, args.max_tpm)
+                return await rename_one(client, sem, args.instruction, args.original, args.content, examples, cache, limiter)
+
+            # Each chunk is packed into one request; chunks run concurrently
+            chunks = [items[i:i + args.batch_size] for i in range(0, len(items), args.batch_size)]
+
+            cached = lookup_cache(cache, args.instruction, items, examples)
+            cached_chunks = [cached[i:i + args.batch_size] for i in range(0, len(cached), args.batch_size)]
+
+            max_rpm, max_tpm = args.max_rpm, args.max_tpm
+            log_lines = []
+            # The probe is a billed request, so it's only worth sending when something will hit the API
+            if (
+                len(chunks) > 1
+                and (max_rpm is None or max_tpm is None)
+                and any(name is None for _, name in cached)
+            ):
+                discovered_rpm, discovered_tpm, usage = await discover_rate_limits(client)
+                max_rpm = max_rpm if max_rpm is not None else discovered_rpm
+                max_tpm = max_tpm if max_tpm is not None else discovered_tpm
+                print(f"🚦 Rate limits: {max_rpm or 'unlimited'} RPM, {max_tpm or 'unlimited'} TPM", file=sys.stderr)
+                if usage is not None:
+                    pricing = get_current_pricing(MODEL, usage.prompt_tokens, usage.completion_tokens, get_cached_tokens(usage))
+                    log_lines.append("🚦 Rate-limit probe:\n")
+                    log_lines += format_usage_stats(usage, pricing)
+            limiter = RateLimiter(max_rpm, max_tpm)
+
+            results = await asyncio.gather(*(
+                rename_batch(client, sem, args.instruction, chunk, examples, cache, limiter, chunk_cached)
+                for chunk, chunk_cached in zip(chunks, cached_chunks)
+            ))
+        finally:
+            if cache is not None:
+                cache.close()
+
+        final_filenames = [final_filename for chunk_filenames, _ in results for final_filename in chunk_filenames]
+        log_lines += [line for _, chunk_lines in results for line in chunk_lines]
+        return [(original, final_filename) for (original, _), final_filename in zip(items, final_filenames)], log_lines
+
+def write_output(stdout_lines, log_lines):
+    """
+    Write results to stdout and flush them before the stderr report,
+    so callers waiting on the filename aren't held up by logging
+    """
+    sys.stdout.write("".join(stdout_lines))
+    sys.stdout.flush()
+    sys.stderr.write("".join(log_lines))
+
+def write_renames(renames, log_lines):
+    """
+    Write (original, final_filename) pairs as one JSON object per line, mirroring the batch file
+    """
+    write_output(
+        [_dumps_line({"original": original, "filename": final_filename}).decode("utf-8")
+         for original, final_filename in renames],
+        log_lines,
+    )
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--instruction')
+    parser.add_argument('--content')
+    parser.add_argument('--original')
+    parser.add_argument('--examples', default='', help='Previous rename examples for consistency (newline separated)')
+    parser.add_argument('--batch-file', help='JSONL file with one {"original": ..., "content": ...} object per line')
+    parser.add_argument('--batch-size', type=int, default=10, help='Files packed into a single request in batch mode (default: 10)')
+    parser.add_argument('--concurrency', type=int, default=5, help='Maximum concurrent API requests (default: 5)')
+    parser.add_argument('--batch-api', action='store_true', help='Submit --batch-file as an OpenAI Batch API job (half price, results within 24h) and print its id')
+    parser.add_argument('--poll', metavar='BATCH_ID', help='Wait for a Batch API job and print its renames')
+    parser.add_argument('--poll-interval', type=float, default=60, help='Seconds between Batch API status checks (default: 60)')
+    parser.add_argument('--max-rpm', type=int, help='Requests per minute to stay under (default: read from the API in batch mode)')
+    parser.add_argument('--max-tpm', type=int, help='Tokens per minute to stay under (default: read from the API in batch mode)')
+    parser.add_argument('--no-cache', action='store_true', help='Always call the API instead of reusing cached renames')
+    parser.add_argument('--max-content-tokens', type=int, default=MAX_CONTENT_TOKENS, help=f'Truncate file content to this many tokens (default: {MAX_CONTENT_TOKENS})')
+    args = parser.parse_args()
+
+    if args.poll:
+        renames, log_lines = asyncio.run(run(args, "", None))
+        write_renames(renames, log_lines)
+        if not renames:
+            parser.exit(1, f"❌ Batch {args.poll} produced no renames\n")
+        return
+
+    if not args.instruction:
+        parser.error("--instruction is required")
+    if args.batch_api and not args.batch_file:
+        parser.error("--batch-api requires --batch-file")
+    if not args.batch_file and (args.content is None or args.original is None):
+        parser.error("--content and --original are required unless --batch-file is given")
+    if args.batch_size < 1 or args.concurrency < 1 or args.max_content_tokens < 1:
+        parser.error("--batch-size, --concurrency and --max-content-tokens must be at least 1")
+    if (args.max_rpm is not None and args.max_rpm < 1) or (args.max_tpm is not None and args.max_tpm < 1):
+        parser.error("--max-rpm and --max-tpm must be at least 1")
+
+    # Format examples if provided
+    examples = format_examples(args.examples)
+
+    if not args.batch_file:
+        args.content = _truncate_content(args.content, args.max_content_tokens)
+        final_filename, log_lines = asyncio.run(run(args, examples, None))
+        write_output([final_filename + "\n"], log_lines)
+        return
+
+    try:
+        items = load_batch_file(args.batch_file)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if not items:
+        return
+    items = [(original, _truncate_content(content, args.max_content_tokens)) for original, content in items]
+
+    if args.batch_api:
+        print(asyncio.run(run(args, examples, items)))
+        return
 
-    print(final_filename)
+    write_renames(*asyncio.run(run(args, examples, items)))
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -6,10 +6,30 @@ This shows how various injection attempts are handled safely.
 
 import sys
 import os
+import asyncio
+import math
+import tempfile
+from types import SimpleNamespace
 
 # Add current directory to path to import ai_rename
 sys.path.append('.')
-from ai_rename import sanitize_filename
+import ai_rename
+from ai_rename import sanitize_filename, sanitize_filenames
+
+def fake_client(packed_answer, single_answer):
+    """Stand-in OpenAI client that streams canned answers and records each request"""
+    requests = []
+    usage = SimpleNamespace(prompt_tokens=100, completion_tokens=10, total_tokens=110, prompt_tokens_details=None)
+
+    async def stream(text):
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], usage=None)
+        yield SimpleNamespace(choices=[], usage=usage)
+
+    async def create(**params):
+        requests.append(params)
+        return stream(packed_answer if "response_format" in params else single_answer)
+
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create))), requests
 
 def test_sanitization():
     """Test various malicious filename patterns"""
@@ -76,6 +96,10 @@ def test_sanitization():
         print(f"    Status:    {status}")
         print()
     
+    # Batch sanitization must match the per-file function
+    inputs = [malicious_input for malicious_input, _ in test_cases]
+    assert sanitize_filenames(inputs) == [sanitize_filename(name) for name in inputs]
+    
     print("🎯 Security Summary:")
     print("   • Path traversal attempts blocked")
     print("   • Shell metacharacters removed")
@@ -83,8 +107,113 @@ def test_sanitization():
     print("   • Length limits enforced")
     print("   • Hidden files prevented")
     print("   • Empty filenames handled")
+    print("   • Batch sanitization matches per-file results")
     print()
     print("✅ All tests completed - system is protected against injection attacks!")
 
+def test_pricing():
+    """Cached prompt tokens are billed at the cached rate, via tokencost and via the config fallback"""
+    for model in ("gpt-4o-mini", "not-a-real-model"):
+        uncached = ai_rename.get_current_pricing(model, 1000, 1000)
+        cached = ai_rename.get_current_pricing(model, 1000, 1000, cached_tokens=1000)
+        assert math.isclose(uncached["input_cost"], uncached["input"])
+        assert math.isclose(cached["input_cost"], cached["cached_input"])
+        assert math.isclose(cached["output_cost"], uncached["output_cost"])
+        assert math.isclose(cached["total_cost"], cached["input_cost"] + cached["output_cost"])
+    # Unknown models are priced from PRICING_CONFIG
+    assert cached["source"].startswith("config")
+    assert math.isclose(cached["cached_input"], ai_rename.PRICING_CONFIG["gpt-4o-mini"].cached_input)
+
+    print("✅ Cached prompt tokens billed at the cached rate")
+
+def test_cache():
+    """Model answers survive a reopen and are only reused for the same prompt inputs"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cache.sqlite3")
+        key = ai_rename.cache_key("rename", "scan.pdf", "Invoice ACME", "a.pdf -> Invoice")
+        assert key != ai_rename.cache_key("rename", "scan.pdf", "Invoice ACME", "")
+        assert key != ai_rename.cache_key("rename", "scan.pdf", "Receipt", "a.pdf -> Invoice")
+
+        cache = ai_rename.open_cache(path)
+        assert ai_rename.cache_get(cache, key) is None
+        ai_rename.cache_put(cache, key, "Invoice ACME")
+        blank_key = ai_rename.cache_key("rename", "empty.txt", "", "")
+        ai_rename.cache_put(cache, blank_key, "  ")
+        cache.close()
+
+        cache = ai_rename.open_cache(path)
+        assert ai_rename.cache_get(cache, key) == "Invoice ACME"
+        assert ai_rename.cache_get(cache, blank_key) is None
+        cache.close()
+
+    assert ai_rename.cache_get(None, key) is None
+
+    print("✅ Rename cache round-trips answers")
+
+def test_rename_batch():
+    """Packed batch answers are only trusted when they name every file"""
+    assert ai_rename.parse_batch_names('{"filenames": ["a", "b"]}', 2) == ["a", "b"]
+    assert ai_rename.parse_batch_names('{"filenames": ["a"]}', 2) is None
+    assert ai_rename.parse_batch_names('["a", "b"]', 2) is None
+    assert ai_rename.parse_batch_names("not json", 2) is None
+
+    def rename(packed_answer, items):
+        client, requests = fake_client(packed_answer, "Renamed")
+        filenames, log_lines = asyncio.run(
+            ai_rename.rename_batch(client, asyncio.Semaphore(1), "rename", items, "")
+        )
+        return filenames, log_lines, len(requests)
+
+    items = [("scan.pdf", "Invoice ACME"), ("notes", "meeting notes")]
+
+    # One request; answers are sanitized and get their file's extension
+    filenames, log_lines, calls = rename('{"filenames": ["Invoice ACME", "../Meeting Notes"]}', items)
+    assert filenames == ["Invoice ACME.pdf", sanitize_filename("../Meeting Notes") + ".txt"]
+    assert calls == 1
+    assert "  Original:  ../Meeting Notes\n" in log_lines
+
+    # A miscounted answer is discarded and every file is renamed on its own
+    filenames, _, calls = rename('{"filenames": ["Invoice ACME"]}', items)
+    assert filenames == ["Renamed.pdf", "Renamed.txt"]
+    assert calls == 3
+
+    # Unusable entries are renamed on their own instead of becoming unnamed_file
+    items.append(("photo.jpg", "beach"))
+    filenames, _, calls = rename('{"filenames": ["Invoice ACME", null, ""]}', items)
+    assert filenames == ["Invoice ACME.pdf", "Renamed.txt", "Renamed.jpg"]
+    assert calls == 3
+
+    print("✅ Batch answers are matched to files safely")
+
+def test_rate_limiter():
+    """Token reservations leave the window once it has passed, even when recorded late"""
+    async def check():
+        limiter = ai_rename.RateLimiter(max_tpm=1000)
+        first = await limiter.acquire(100)
+        limiter.record(first, 150)
+        assert limiter.tokens_in_window == 150
+
+        await asyncio.sleep(ai_rename.RATE_LIMIT_WINDOW)
+        second = await limiter.acquire(10)
+        assert limiter.tokens_in_window == 10
+
+        # A request that outlasted the window no longer counts towards it
+        limiter.record(first, 200)
+        limiter.record(second, 20)
+        assert limiter.tokens_in_window == 20
+
+    window = ai_rename.RATE_LIMIT_WINDOW
+    ai_rename.RATE_LIMIT_WINDOW = 0.05
+    try:
+        asyncio.run(check())
+    finally:
+        ai_rename.RATE_LIMIT_WINDOW = window
+
+    print("✅ Rate-limit window accounting stays consistent")
+
 if __name__ == "__main__":
-    test_sanitization() 
\ No newline at end of file
+    test_sanitization()
+    test_pricing()
+    test_cache()
+    test_rename_batch()
+    test_rate_limiter()